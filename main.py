@@ -1,12 +1,19 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import cycle
 from json import dumps, loads
-from pandas import read_csv, to_datetime
+from multiprocessing import Process
+from pandas import concat, DataFrame, read_csv, to_datetime
 
-from modules.environment import DATA_PATH, DATA_FIXED_PATH
+from modules.environment import DATA_PATH, DATA_FIXED_PATH, JOB_DATABASE_URL, MYSQL_PUSHDOWN, \
+                                POSTGRES_TARGETS
+from modules.jobs import JobStore, LeaseLostError, run_worker, split_into_shards
 from modules.logging import logging
 from modules.model import MySQLConnection, PostgreSQLConnection
+from modules.plan import extrapolate, get_peak_rss, StageMeasure
 from modules.utils import delete_and_recreate_folder
 
 
@@ -77,11 +84,127 @@ def generate_insert_clause_column(row):
     )
 
 
+def generate_collections_extents(df_item):
+    """Generate the temporal and spatial extents of all collections based on their items, in just one groupby"""
+
+    return df_item.groupby('collection_id', as_index=False).agg(
+        start_date=('datetime', 'min'),
+        end_date=('datetime', 'max'),
+        min_x=('bl_longitude', 'min'),
+        min_y=('bl_latitude', 'min'),
+        max_x=('tr_longitude', 'max'),
+        max_y=('tr_latitude', 'max')
+    )
+
+
+def merge_collections_extents(df_extents):
+    """Merge the extents generated by chunks of items (e.g. shards) into one extent by collection"""
+
+    return df_extents.groupby('collection_id', as_index=False).agg(
+        start_date=('start_date', 'min'),
+        end_date=('end_date', 'max'),
+        min_x=('min_x', 'min'),
+        min_y=('min_y', 'min'),
+        max_x=('max_x', 'max'),
+        max_y=('max_y', 'max')
+    )
+
+
 class MigrateDBs():
 
-    def __init__(self):
-        # create PostgreSQL connection
-        self.db_postgres = PostgreSQLConnection()
+    def __init__(self, db_postgres_targets=None, is_pushdown=MYSQL_PUSHDOWN, batch_size=10000):
+        # number of items inserted at a time
+        self.batch_size = batch_size
+
+        # heartbeat of the shard that is being migrated (just in the sharded mode)
+        self.heartbeat = None
+
+        # if it is True, then the items are got from MySQL already fixed, and the transform does less work
+        self.is_pushdown = is_pushdown
+
+        # create the PostgreSQL connections, one for each target database
+        if db_postgres_targets is None:
+            db_postgres_targets = [PostgreSQLConnection(url, name=name) for name, url in POSTGRES_TARGETS]
+
+            # if there are not targets, then use the one configured by the `PG*` environment variables
+            if not db_postgres_targets:
+                db_postgres_targets = [PostgreSQLConnection()]
+
+        # the failures are kept by target name, then the names must be unique
+        names = [db_postgres.name for db_postgres in db_postgres_targets]
+        if len(set(names)) != len(names):
+            raise Exception(f'The PostgreSQL targets must have unique names: {names}')
+
+        self.db_postgres_targets = db_postgres_targets
+
+        # error of each target that has failed, by target name
+        self.failed_targets = {}
+
+        # the same data is written to all targets at the same time
+        self.executor = ThreadPoolExecutor(max_workers=len(self.db_postgres_targets))
+
+    ##################################################
+    # targets
+    ##################################################
+
+    def __execute_on_targets(self, function):
+        """Execute `function(db_postgres)` on all the targets that have not failed yet, concurrently.
+        If a target fails, then it is skipped from now on and the others go on."""
+
+        db_postgres_targets = [
+            db_postgres for db_postgres in self.db_postgres_targets
+            if db_postgres.name not in self.failed_targets
+        ]
+
+        futures = {
+            self.executor.submit(function, db_postgres): db_postgres
+            for db_postgres in db_postgres_targets
+        }
+
+        for future in as_completed(futures):
+            db_postgres = futures[future]
+
+            try:
+                future.result()
+
+            except Exception as error:
+                self.failed_targets[db_postgres.name] = str(error)
+                logging.error(f'`{db_postgres.name}` target has failed and it will be skipped from now on: {error}\n')
+
+        if len(self.failed_targets) == len(self.db_postgres_targets):
+            raise Exception('All PostgreSQL targets have failed.')
+
+    def __check_lease(self):
+        """Stop the migration of a shard if the worker has lost it, because another worker is doing it again"""
+
+        if self.heartbeat is not None and self.heartbeat.is_lease_lost():
+            raise LeaseLostError('The lease of the shard has been lost.')
+
+    def __log_step_success(self, message):
+        """Log the success of a step, or in how many targets it has succeeded if some target has failed"""
+
+        if not self.failed_targets:
+            logging.info(f'{message} sucessfully!\n')
+            return
+
+        succeeded = len(self.db_postgres_targets) - len(self.failed_targets)
+        logging.warning(f'{message} in {succeeded} of {len(self.db_postgres_targets)} targets, '
+                        f'the other ones have failed: {list(self.failed_targets.keys())}\n')
+
+    def __report_targets(self):
+        """Report the success or failure of each target"""
+
+        logging.info('**************************************************')
+        logging.info('*                __report_targets                *')
+        logging.info('**************************************************')
+
+        for db_postgres in self.db_postgres_targets:
+            if db_postgres.name in self.failed_targets:
+                logging.error(f'`{db_postgres.name}` target: FAILED - {self.failed_targets[db_postgres.name]}')
+            else:
+                logging.info(f'`{db_postgres.name}` target: SUCCESS')
+
+        logging.info('')
 
     ##################################################
     # get the dataframes
@@ -93,7 +216,14 @@ class MigrateDBs():
 
         # get the dfs from database
         self.df_collection = db_mysql.select_from_collection()
-        self.df_item = db_mysql.select_from_item()
+
+        if self.is_pushdown:
+            # the collection ids are generated in the same way as `__configure_df_collection` does
+            collection_ids = {name: index + 1 for index, name in enumerate(self.df_collection['id'])}
+
+            self.df_item = db_mysql.select_from_item_pushdown(collection_ids)
+        else:
+            self.df_item = db_mysql.select_from_item()
 
     def __get_dfs_from_csv_files(self, collection_file_name='collection.csv',
                                                            item_file_name='item.csv',
@@ -103,6 +233,10 @@ class MigrateDBs():
         self.df_collection = read_csv(DATA_PATH + collection_file_name)
         self.df_item = read_csv(DATA_PATH + item_file_name)
 
+        self.__get_dfs_resolution_and_sensor_from_csv_files(resolution_unit_file_name, sensor_file_name)
+
+    def __get_dfs_resolution_and_sensor_from_csv_files(self, resolution_unit_file_name='resolution_unit.csv',
+                                                       sensor_file_name='sensor.csv'):
         self.df_resolution_unit = read_csv(DATA_FIXED_PATH + resolution_unit_file_name)
         self.df_sensor = read_csv(DATA_FIXED_PATH + sensor_file_name)
 
@@ -133,11 +267,14 @@ class MigrateDBs():
         # tables to clear in the database
         tables = ['bdc.collections', 'bdc.items', 'bdc.bands', 'bdc.resolution_unit']
 
-        for table in tables:
-            self.db_postgres.delete_from_table(table)
-            logging.info(f'`{table}` table has been cleared sucessfully!')
+        def clear_tables(db_postgres):
+            for table in tables:
+                db_postgres.delete_from_table(table)
+                logging.info(f'`{db_postgres.name}` - `{table}` table has been cleared sucessfully!')
 
-        logging.info(f'All tables have been cleared in the database sucessfully!\n')
+        self.__execute_on_targets(clear_tables)
+
+        self.__log_step_success('All tables have been cleared in the database')
 
     ##################################################
     # df_resolution_unit and df_sensor
@@ -162,11 +299,14 @@ class MigrateDBs():
         logging.info('*      __insert_df_resolution_into_database      *')
         logging.info('**************************************************')
 
-        for resolution in self.df_resolution_unit.itertuples():
-            logging.info(f'Inserting `{resolution.name}` resolution in the database...')
-            self.db_postgres.insert_into_resolution(**resolution._asdict())
+        def insert_resolutions(db_postgres):
+            for resolution in self.df_resolution_unit.itertuples():
+                logging.info(f'`{db_postgres.name}` - Inserting `{resolution.name}` resolution in the database...')
+                db_postgres.insert_into_resolution(**resolution._asdict())
+
+        self.__execute_on_targets(insert_resolutions)
 
-        logging.info(f'All resolutions have been inserted in the database sucessfully!\n')
+        self.__log_step_success('All resolutions have been inserted in the database')
 
     def __get_collection_id_based_on(self, sensor, level):
         # get `collection` by sensor and level
@@ -190,6 +330,9 @@ class MigrateDBs():
         resolution_unit_id = int(self.df_resolution_unit[self.df_resolution_unit['name'] == 'micrometre'].at[0, 'id'])
         logging.info(f'resolution_unit_id: {resolution_unit_id}')
 
+        # generate the bands once, then insert them in all targets
+        bands = []
+
         for sensor in self.df_sensor.itertuples():
             for band in loads(sensor.bands):
                 for level in loads(sensor.levels):
@@ -197,12 +340,18 @@ class MigrateDBs():
                     band["metadata"] = dumps({'sensor': sensor.name, 'level': level})
                     band["collection_id"] = self.__get_collection_id_based_on(sensor.name, level)
 
-                    logging.info(f'Inserting `{band["description"]}` element in the database...')
-                    self.db_postgres.insert_into_bands(id=id, **band, resolution_unit_id=resolution_unit_id)
+                    bands.append({'id': id, **band, 'resolution_unit_id': resolution_unit_id})
 
                     id += 1
 
-        logging.info(f'All elements have been inserted in the database sucessfully!\n')
+        def insert_bands(db_postgres):
+            for band in bands:
+                logging.info(f'`{db_postgres.name}` - Inserting `{band["description"]}` element in the database...')
+                db_postgres.insert_into_bands(**band)
+
+        self.__execute_on_targets(insert_bands)
+
+        self.__log_step_success('All elements have been inserted in the database')
 
     ##################################################
     # df_collection
@@ -242,10 +391,41 @@ class MigrateDBs():
         logging.info('*      __insert_df_collection_into_database      *')
         logging.info('**************************************************')
 
-        for collection in self.df_collection.itertuples():
-            logging.info(f'Inserting `{collection.name}` collection in the database...')
-            self.db_postgres.insert_into_collections(**collection._asdict())
-        logging.info(f'All collections have been inserted in the database sucessfully!\n')
+        def insert_collections(db_postgres):
+            for collection in self.df_collection.itertuples():
+                logging.info(f'`{db_postgres.name}` - Inserting `{collection.name}` collection in the database...')
+                db_postgres.insert_into_collections(**collection._asdict())
+
+        self.__execute_on_targets(insert_collections)
+
+        self.__log_step_success('All collections have been inserted in the database')
+
+    def __update_collections_extents_in_the_database(self, df_extents):
+        """Update the dates and the extent of the collections based on their migrated items"""
+
+        logging.info('**************************************************')
+        logging.info('*  __update_collections_extents_in_the_database  *')
+        logging.info('**************************************************')
+
+        logging.info(f'df_extents: \n{df_extents} \n')
+
+        # the collections have dates without time
+        extents = [
+            {
+                'id': int(extent.collection_id),
+                'start_date': to_datetime(extent.start_date).date(),
+                'end_date': to_datetime(extent.end_date).date(),
+                'min_x': float(extent.min_x),
+                'min_y': float(extent.min_y),
+                'max_x': float(extent.max_x),
+                'max_y': float(extent.max_y)
+            }
+            for extent in df_extents.itertuples()
+        ]
+
+        self.__execute_on_targets(lambda db_postgres: db_postgres.update_collections_extents(extents))
+
+        self.__log_step_success(f'The extents of {len(extents)} collections have been updated in the database')
 
     ##################################################
     # df_item
@@ -275,6 +455,11 @@ class MigrateDBs():
         self.df_item['tr_longitude'] = self.df_item['tr_longitude'].astype(float)
         self.df_item['tr_latitude'] = self.df_item['tr_latitude'].astype(float)
 
+    def __configure_df_item__fix_columns_types_pushdown(self):
+        # the other columns have been already fixed by MySQL, then just convert dates from `str` to `date`
+        self.df_item['datetime'] = to_datetime(self.df_item['datetime'])
+        self.df_item['date'] = to_datetime(self.df_item['date']).dt.date
+
     def __fix_df_item_columns_order(self):
         # get columns
         columns = self.df_item.columns.tolist()
@@ -288,7 +473,7 @@ class MigrateDBs():
         # reorder columns
         self.df_item = self.df_item[columns]
 
-    def __configure_df_item(self):
+    def __configure_df_item(self, id_offset=0):
         logging.info('**************************************************')
         logging.info('*              __configure_df_item               *')
         logging.info('**************************************************')
@@ -296,23 +481,28 @@ class MigrateDBs():
         # rename column from `ìd` to `name`
         self.df_item.rename(columns={'id': 'name'}, inplace=True)
 
-        # create `id` column based on the row index value
-        self.df_item["id"] = self.df_item.index + 1
+        # create `id` column based on the row index value (a shard starts its ids after `id_offset`)
+        self.df_item["id"] = self.df_item.index + 1 + id_offset
 
         # put `id` column as the first column
         self.df_item = self.df_item[['id'] + [col for col in self.df_item.columns if col != 'id']]
 
-        self.__configure_df_item__fix_columns_types()
+        if self.is_pushdown:
+            self.__configure_df_item__fix_columns_types_pushdown()
+        else:
+            self.__configure_df_item__fix_columns_types()
 
+        # empty thumbnails are read as `NaN` from the CSV file, even if MySQL has filled them
         self.df_item['thumbnail'] = self.df_item['thumbnail'].fillna('')
 
         # fix `aseets` column, merge `thumbnail` in `assets`
         self.df_item['assets'] = self.df_item[['thumbnail', 'assets']].apply(fix_assets, axis=1)
 
-        # generate collection_id column
-        self.df_item['collection_id'] = self.df_item["collection"].apply(
-            lambda collection: generate_collection_id_column(collection, self.df_collection)
-        )
+        # generate collection_id column, if MySQL has not done it
+        if not self.is_pushdown:
+            self.df_item['collection_id'] = self.df_item["collection"].apply(
+                lambda collection: generate_collection_id_column(collection, self.df_collection)
+            )
 
         # generate INSERT clause for each row
         self.df_item['insert'] = self.df_item.apply(generate_insert_clause_column, axis=1)
@@ -336,7 +526,7 @@ class MigrateDBs():
         logging.info(f'size_df_item: {size_df_item}')
 
         # fill `items` table by chunks
-        step = 10000
+        step = self.batch_size
         for start_slice in range(0, size_df_item, step):
             end_slice = start_slice + step
             if end_slice > size_df_item:
@@ -345,10 +535,234 @@ class MigrateDBs():
             # concatenate the INSERT clauses to execute many statements in one time
             insert_clauses = ' '.join(self.df_item[start_slice:end_slice]['insert'].tolist())
 
+            self.__check_lease()
+
             logging.info(f'Inserting items[{start_slice}, {end_slice}] in the database...')
-            self.db_postgres.execute(insert_clauses, is_transaction=True)
+            self.__execute_on_targets(
+                lambda db_postgres: db_postgres.execute(insert_clauses, is_transaction=True)
+            )
 
-        logging.info(f'All items have been inserted in the database sucessfully!\n')
+        self.__log_step_success('All items have been inserted in the database')
+
+    ##################################################
+    # plan
+    ##################################################
+
+    def __get_df_item_from_mysqldb(self, db_mysql, **filters):
+        if self.is_pushdown:
+            # `df_collection` has been already configured, then it has the final ids
+            collection_ids = dict(zip(self.df_collection['name'], self.df_collection['id']))
+
+            self.df_item = db_mysql.select_from_item_pushdown(collection_ids, **filters)
+        else:
+            self.df_item = db_mysql.select_from_item(**filters)
+
+    def plan(self, fraction=0.01, workers=(1, 2, 4, 8), batch_sizes=(1000, 5000, 10000), shard_size=100000):
+        """Migrate a random sample of the items to a dry run of the first target, measure each stage and
+        extrapolate the wall time, the peak RSS and the size of the items table to the full catalog,
+        migrated by workers in shards of up to `shard_size` items"""
+
+        logging.info('**************************************************')
+        logging.info('*                      plan                      *')
+        logging.info('**************************************************')
+
+        baseline_rss = get_peak_rss()
+
+        db_mysql = MySQLConnection()
+
+        total_rows = db_mysql.select_count_from_item()
+
+        self.df_collection = db_mysql.select_from_collection()
+        self.__configure_df_collection()
+
+        # the sample scans the whole table and opens a connection, whatever the number of rows it returns,
+        # then a query without rows measures this fixed cost, so that it is not extrapolated by row
+        with StageMeasure('extract_overhead') as extract_overhead:
+            self.__get_df_item_from_mysqldb(db_mysql, fraction=0)
+
+        # extract
+        with StageMeasure('extract') as extract:
+            self.__get_df_item_from_mysqldb(db_mysql, fraction=fraction)
+        extract.bytes = self.df_item.memory_usage(deep=True).sum()
+        extract.overhead = min(extract_overhead.seconds, extract.seconds)
+
+        sample_rows = len(self.df_item)
+
+        if sample_rows == 0:
+            raise Exception(f'The sample of items is empty, then increase the fraction (fraction: {fraction}).')
+
+        # transform
+        with StageMeasure('transform') as transform:
+            self.__configure_df_item()
+        transform.bytes = self.df_item.memory_usage(deep=True).sum()
+
+        # split the sample in batches of several sizes, to separate the cost of a batch from the cost of a row
+        inserts = self.df_item['insert'].tolist()
+        queries, batches_rows = [], []
+        batch_sizes_cycle = cycle(batch_sizes)
+
+        start_slice = 0
+        while start_slice < sample_rows:
+            end_slice = min(start_slice + next(batch_sizes_cycle), sample_rows)
+
+            queries.append(' '.join(inserts[start_slice:end_slice]))
+            batches_rows.append(end_slice - start_slice)
+
+            start_slice = end_slice
+
+        # load
+        with StageMeasure('load') as load:
+            batches_seconds, load.bytes = self.db_postgres_targets[0].execute_dry_run(queries)
+
+        estimates = extrapolate(
+            extract, transform, load, list(zip(batches_rows, batches_seconds)),
+            sample_rows, total_rows, baseline_rss, workers=workers, batch_sizes=batch_sizes, shard_size=shard_size
+        )
+
+        logging.info(f'sample: {sample_rows} of {total_rows} items (fraction: {fraction})')
+        logging.info(f'target: `{self.db_postgres_targets[0].name}` (dry run) - shard_size: {shard_size}\n')
+
+        for stage in (extract, transform, load):
+            per_row = stage.per_row(sample_rows)
+            logging.info(f'{stage.name}: {stage.seconds:.3f} s (fixed: {stage.overhead:.3f} s) - '
+                         f'per row: {per_row["seconds"] * 1000:.4f} ms, '
+                         f'{per_row["bytes"]:.0f} bytes, {per_row["rss"]:.0f} bytes of RSS')
+
+        logging.info('')
+
+        for estimate in estimates:
+            logging.info(f'workers: {estimate["workers"]} - batch_size: {estimate["batch_size"]} - '
+                         f'wall time: {estimate["wall_time"] / 60:.1f} min - '
+                         f'peak RSS: {estimate["peak_rss"] / 1024 ** 2:.0f} MiB '
+                         f'({estimate["peak_rss_per_worker"] / 1024 ** 2:.0f} MiB per worker) - '
+                         f'items table: {estimate["table_bytes"] / 1024 ** 2:.0f} MiB')
+
+        logging.info('')
+
+        return estimates
+
+    ##################################################
+    # shards
+    ##################################################
+
+    def prepare_shards(self, job_store, by='collection', shard_size=100000):
+        """Insert everything but the items in the targets and split the items in shards.
+        The catalog must not change until all the shards are done, because the ids of the items in the targets
+        are based on the number of items of each shard."""
+
+        logging.info('**************************************************')
+        logging.info('*                 prepare_shards                 *')
+        logging.info('**************************************************')
+
+        db_mysql = MySQLConnection()
+
+        self.df_collection = db_mysql.select_from_collection()
+        self.__configure_df_collection()
+
+        self.__get_dfs_resolution_and_sensor_from_csv_files()
+        self.__configure_dfs_resolution_and_sensor()
+
+        self.__clear_tables_in_the_database()
+
+        self.__insert_df_collection_into_database()
+        self.__insert_df_resolution_into_database()
+        self.__insert_df_sensor_into_database()
+
+        self.__report_targets()
+
+        if self.failed_targets:
+            raise Exception(f'The targets could not be prepared: {list(self.failed_targets.keys())}')
+
+        counts = [
+            (count.collection, int(count.count))
+            for count in db_mysql.select_count_from_item_by_collection().itertuples()
+        ]
+        shards = split_into_shards(counts, shard_size, db_mysql.select_last_id_from_item, by=by)
+
+        job_store.create_shards(shards)
+
+        logging.info(f'{len(shards)} shards have been created by `{by}` with up to {shard_size} items each.\n')
+
+    def migrate_shard(self, shard, heartbeat=None):
+        """Extract, transform and load the items of the shard in all the targets.
+        It stops raising `LeaseLostError` when the `heartbeat` has lost the lease, before writing in the targets."""
+
+        self.heartbeat = heartbeat
+
+        try:
+            return self.__migrate_shard(shard)
+
+        finally:
+            self.heartbeat = None
+
+    def __migrate_shard(self, shard):
+        logging.info('**************************************************')
+        logging.info(f'*{("migrate_shard - " + str(shard["id"])).center(48)}*')
+        logging.info('**************************************************')
+
+        # a shard must be migrated to all the targets, then a target that has failed before is tried again
+        self.failed_targets = {}
+
+        db_mysql = MySQLConnection()
+
+        self.df_collection = db_mysql.select_from_collection()
+        self.__configure_df_collection()
+
+        self.__get_df_item_from_mysqldb(
+            db_mysql, collection=shard['collection'], after_id=shard['after_id'], last_id=shard['last_id']
+        )
+
+        # the ids of the shard in the targets are based on the number of items it had when it was created
+        if len(self.df_item) != shard['rows']:
+            raise Exception(f'The shard {shard["id"]} should have {shard["rows"]} items, but it has '
+                            f'{len(self.df_item)}. The catalog must not change until all the shards are done.')
+        self.__configure_df_item(id_offset=shard['id_offset'])
+
+        self.__check_lease()
+
+        # delete the items of a previous attempt of this shard, since the ids of a shard are always the same
+        first_id, last_id = shard['id_offset'] + 1, shard['id_offset'] + shard['rows']
+        self.__execute_on_targets(
+            lambda db_postgres: db_postgres.delete_from_items_by_id_range(first_id, last_id)
+        )
+
+        self.__insert_df_item_into_database()
+
+        self.__report_targets()
+
+        if self.failed_targets:
+            raise Exception(f'The shard {shard["id"]} has failed in the targets: {list(self.failed_targets.keys())}')
+
+        # the extents of the shard are saved in the job table, to be merged with the other shards when all are done
+        # the collections have dates without time, then just the dates are saved
+        df_extents = generate_collections_extents(self.df_item)
+        df_extents['start_date'] = df_extents['start_date'].dt.strftime('%Y-%m-%d')
+        df_extents['end_date'] = df_extents['end_date'].dt.strftime('%Y-%m-%d')
+
+        return df_extents.to_json(orient='records')
+
+    def finalize_shards(self, job_store):
+        """Update the extents of the collections based on the items of all the shards"""
+
+        logging.info('**************************************************')
+        logging.info('*                finalize_shards                 *')
+        logging.info('**************************************************')
+
+        if job_store.has_unfinished_shards() or job_store.select_failed_shards():
+            raise Exception('All the shards must be done before finalizing the migration.')
+
+        results = job_store.select_results()
+
+        if not results:
+            raise Exception('There are not results of shards to finalize the migration.')
+
+        df_extents = concat([DataFrame(loads(result)) for result in results], ignore_index=True)
+        df_extents['start_date'] = to_datetime(df_extents['start_date'])
+        df_extents['end_date'] = to_datetime(df_extents['end_date'])
+
+        self.__update_collections_extents_in_the_database(merge_collections_extents(df_extents))
+
+        self.__report_targets()
 
     ##################################################
     # main
@@ -389,6 +803,10 @@ class MigrateDBs():
         self.__insert_df_sensor_into_database()
         self.__insert_df_item_into_database()
 
+        self.__update_collections_extents_in_the_database(generate_collections_extents(self.df_item))
+
+        self.__report_targets()
+
     def main(self):
         # self.__main__get_dfs_configure_dfs_and_save_dfs(is_to_get_dfs_from_db=True)
 
@@ -399,7 +817,11 @@ class MigrateDBs():
 
         self.__configure_dfs_resolution_and_sensor()
         self.__configure_df_collection__fix_columns_types()
-        self.__configure_df_item__fix_columns_types()
+
+        if self.is_pushdown:
+            self.__configure_df_item__fix_columns_types_pushdown()
+        else:
+            self.__configure_df_item__fix_columns_types()
 
         logging.info('**************************************************')
         logging.info('*                      main                      *')
@@ -411,6 +833,82 @@ class MigrateDBs():
         self.__main__clear_and_insert_values_in_the_database()
 
 
+def work(job_database_url, lease_seconds, batch_size):
+    """Run a worker process, that migrates the shards until there are not shards left"""
+
+    # the connections are created inside the process, because they can not be shared between processes
+    job_store = JobStore(job_database_url)
+    migrate = MigrateDBs(batch_size=batch_size)
+
+    run_worker(job_store, migrate.migrate_shard, lease_seconds=lease_seconds)
+
+
 if __name__ == "__main__":
-    migrate = MigrateDBs()
-    migrate.main()
+    parser = ArgumentParser(description='Migrate the catalog from MySQL to PostgreSQL.')
+    parser.add_argument('--batch-size', type=int, default=10000, help='number of items inserted at a time')
+
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('migrate', help='migrate the catalog (default)')
+
+    plan_parser = subparsers.add_parser('plan', help='estimate the migration based on a sample of the items')
+    plan_parser.add_argument('--fraction', type=float, default=0.01, help='fraction of the items to sample')
+    plan_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8],
+                             help='numbers of workers to estimate')
+    plan_parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1000, 5000, 10000],
+                             help='batch sizes to measure and estimate')
+    plan_parser.add_argument('--shard-size', type=int, default=100000,
+                             help='maximum number of items by shard of the workers to estimate')
+
+    coordinator_parser = subparsers.add_parser('coordinator', help='prepare the targets and split the items in shards')
+    coordinator_parser.add_argument('--job-database-url', default=JOB_DATABASE_URL, help='URL of the job database')
+    coordinator_parser.add_argument('--by', choices=['collection', 'range'], default='collection',
+                                    help='split the items by collection or by ranges of ids')
+    coordinator_parser.add_argument('--shard-size', type=int, default=100000, help='maximum number of items by shard')
+
+    worker_parser = subparsers.add_parser('worker', help='claim and migrate the shards')
+    worker_parser.add_argument('--job-database-url', default=JOB_DATABASE_URL, help='URL of the job database')
+    worker_parser.add_argument('--processes', type=int, default=1, help='number of worker processes in this node')
+    worker_parser.add_argument('--lease-seconds', type=int, default=60,
+                               help='time without heartbeat after which a shard can be claimed by another worker')
+
+    finalize_parser = subparsers.add_parser('finalize', help='update the collections when all the shards are done')
+    finalize_parser.add_argument('--job-database-url', default=JOB_DATABASE_URL, help='URL of the job database')
+
+    status_parser = subparsers.add_parser('status', help='show the status of the shards')
+    status_parser.add_argument('--job-database-url', default=JOB_DATABASE_URL, help='URL of the job database')
+
+    args = parser.parse_args()
+
+    if args.command == 'worker':
+        processes = [
+            Process(target=work, args=(args.job_database_url, args.lease_seconds, args.batch_size))
+            for _ in range(args.processes)
+        ]
+
+        for process in processes:
+            process.start()
+
+        for process in processes:
+            process.join()
+
+    elif args.command == 'status':
+        job_store = JobStore(args.job_database_url)
+
+        for status in job_store.select_status():
+            logging.info(f'{status["status"]}: {status["shards"]} shards - {status["rows"]} items')
+
+        for shard in job_store.select_failed_shards():
+            logging.error(f'shard {shard["id"]} has failed: {shard["error"]}')
+
+    else:
+        migrate = MigrateDBs(batch_size=args.batch_size)
+
+        if args.command == 'plan':
+            migrate.plan(fraction=args.fraction, workers=args.workers, batch_sizes=args.batch_sizes,
+                         shard_size=args.shard_size)
+        elif args.command == 'coordinator':
+            migrate.prepare_shards(JobStore(args.job_database_url), by=args.by, shard_size=args.shard_size)
+        elif args.command == 'finalize':
+            migrate.finalize_shards(JobStore(args.job_database_url))
+        else:
+            migrate.main()
@@ -6,7 +6,7 @@
 from os import environ
 from logging import DEBUG, INFO
 
-from modules.utils import str2bool
+from modules.utils import parse_postgres_targets, str2bool
 
 
 os_environ_get = environ.get
@@ -23,6 +23,8 @@ MYSQL_PASSWORD = os_environ_get('MYSQL_PASSWORD', 'password')
 MYSQL_HOST = os_environ_get('MYSQL_HOST', 'localhost')
 MYSQL_PORT = int(os_environ_get('MYSQL_PORT', 9004))
 MYSQL_DATABASE = os_environ_get('MYSQL_DATABASE', 'catalog_rubi')
+# if it is True, then the items are selected with the columns already fixed by MySQL
+MYSQL_PUSHDOWN = str2bool(os_environ_get('MYSQL_PUSHDOWN', 'False'))
 
 # Postgres connection
 # PGUSER = os_environ_get('PGUSER', 'root')
@@ -31,6 +33,13 @@ MYSQL_DATABASE = os_environ_get('MYSQL_DATABASE', 'catalog_rubi')
 # PGPORT = int(os_environ_get('PGPORT', 9004))
 # PGDATABASE = os_environ_get('PGDATABASE', 'catalog')
 
+# PostgreSQL targets, as a comma separated list of `name=url` pairs (e.g. `staging=postgresql+psycopg2://...`).
+# If it is empty, then just one target is used, which is configured by the `PG*` environment variables
+POSTGRES_TARGETS = parse_postgres_targets(os_environ_get('POSTGRES_TARGETS', ''))
+
+# database of the shards used by the coordinator and the workers (SQLite or PostgreSQL)
+JOB_DATABASE_URL = os_environ_get('JOB_DATABASE_URL', 'sqlite:///jobs.sqlite')
+
 # default logging level in production server
 LOGGING_LEVEL = INFO
 
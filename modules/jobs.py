@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+
+"""Job table used to split the migration in shards, that are claimed by workers on any node"""
+
+from os import getpid
+from socket import gethostname
+from threading import Event, Thread
+from time import sleep, time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from modules.logging import logging
+
+
+def split_into_shards(counts, shard_size, find_last_id, by='collection'):
+    """Split the items in shards of at most `shard_size` rows.
+
+    `counts` is a list of `(collection, count)` ordered by collection. If `by` is `collection`, then each shard
+    has items of just one collection, otherwise the shards are ranges of all the items ordered by id.
+    The items of a shard are the ones with `after_id < id <= last_id`, where `last_id` is got by
+    `find_last_id(rows, collection=collection, after_id=after_id)`.
+    Each shard receives the ids `id_offset + 1` to `id_offset + rows` in the PostgreSQL database."""
+
+    if by == 'collection':
+        # a shard without collection would select all the items, and an item without collection can not be migrated
+        if any(collection is None for collection, _ in counts):
+            raise Exception('There are items without collection, then they can not be split by collection.')
+
+        groups = counts
+    elif by == 'range':
+        groups = [(None, sum(count for _, count in counts))]
+    else:
+        raise Exception(f'Invalid shard type: `{by}`. It must be `collection` or `range`.')
+
+    shards = []
+    id_offset = 0
+
+    for collection, count in groups:
+        after_id = None
+
+        for start_row in range(0, count, shard_size):
+            rows = min(shard_size, count - start_row)
+            last_id = find_last_id(rows, collection=collection, after_id=after_id)
+
+            shards.append({
+                'id': len(shards) + 1,
+                'collection': collection,
+                'after_id': after_id,
+                'last_id': last_id,
+                'rows': rows,
+                'id_offset': id_offset
+            })
+
+            after_id = last_id
+            id_offset += rows
+
+    return shards
+
+
+class JobStore():
+    """Shards of the migration, saved in a SQLite or PostgreSQL database.
+
+    A shard is `pending` until a worker claims it, then it is `running` while the worker renews its lease.
+    If the lease expires (e.g. the worker has died), then another worker can claim the shard again."""
+
+    def __init__(self, url, max_attempts=3):
+        # SQLite locks the whole database on writes, then wait for the other workers
+        connect_args = {'timeout': 30} if url.startswith('sqlite') else {}
+
+        try:
+            self.engine = create_engine(url, connect_args=connect_args)
+
+        except SQLAlchemyError as error:
+            logging.error(f'JobStore.__init__() - An error occurred during engine creation.')
+            logging.error(f'JobStore.__init__() - error: {error}\n')
+
+            raise SQLAlchemyError(error)
+
+        self.max_attempts = max_attempts
+
+    def execute(self, query, params=None):
+        logging.debug(f'JobStore.execute() - query: {query}')
+        logging.debug(f'JobStore.execute() - params: {params}')
+
+        try:
+            with self.engine.begin() as connection:  # runs a transaction
+                result = connection.execute(text(query), params or {})
+
+                if result.returns_rows:
+                    return [dict(row) for row in result.fetchall()]
+
+                return result.rowcount
+
+        except SQLAlchemyError as error:
+            logging.error(f'JobStore.execute() - An error occurred during query execution.')
+            logging.error(f'JobStore.execute() - error: {error}\n')
+
+            raise SQLAlchemyError(error)
+
+    ##################################################
+    # coordinator
+    ##################################################
+
+    def create_shards(self, shards):
+        """Recreate the job table with the shards"""
+
+        self.execute('DROP TABLE IF EXISTS migration_shards;')
+        self.execute(
+            'CREATE TABLE migration_shards ('
+            'id INTEGER PRIMARY KEY, collection VARCHAR(255), after_id VARCHAR(255), last_id VARCHAR(255) NOT NULL, '
+            'rows INTEGER NOT NULL, id_offset INTEGER NOT NULL, status VARCHAR(16) NOT NULL, '
+            'worker VARCHAR(255), lease_expires_at DOUBLE PRECISION, heartbeat_at DOUBLE PRECISION, '
+            'attempts INTEGER NOT NULL, error TEXT, result TEXT);'
+        )
+
+        # an empty catalog has not shards, and an INSERT without values fails
+        if not shards:
+            return
+
+        with self.engine.begin() as connection:
+            connection.execute(
+                text(
+                    'INSERT INTO migration_shards (id, collection, after_id, last_id, rows, id_offset, status, attempts) '
+                    'VALUES (:id, :collection, :after_id, :last_id, :rows, :id_offset, \'pending\', 0);'
+                ),
+                shards
+            )
+
+    def select_status(self):
+        """Return the number of shards and rows by status"""
+
+        return self.execute(
+            'SELECT status, COUNT(*) AS shards, SUM(rows) AS rows FROM migration_shards GROUP BY status ORDER BY status;'
+        )
+
+    def select_results(self):
+        """Return the results saved by the workers of the done shards"""
+
+        shards = self.execute(
+            'SELECT result FROM migration_shards WHERE status = \'done\' AND result IS NOT NULL ORDER BY id;'
+        )
+
+        return [shard['result'] for shard in shards]
+
+    def select_failed_shards(self):
+        return self.execute('SELECT * FROM migration_shards WHERE status = \'failed\' ORDER BY id;')
+
+    ##################################################
+    # worker
+    ##################################################
+
+    def fail_expired_shards(self, now):
+        """Mark as failed the shards whose lease has expired after `max_attempts`, since their workers have died
+        (e.g. killed by lack of memory), then the shard would kill all the workers one by one"""
+
+        self.execute(
+            'UPDATE migration_shards '
+            'SET status = \'failed\', lease_expires_at = NULL, '
+            'error = \'worker lost: the lease has expired in all the attempts\' '
+            'WHERE status = \'running\' AND lease_expires_at < :now AND attempts >= :max_attempts;',
+            {'now': now, 'max_attempts': self.max_attempts}
+        )
+
+    def claim_shard(self, worker, lease_seconds):
+        """Claim a pending shard, or a running shard whose lease has expired and has attempts left.
+        Return the shard or `None` if there is not any shard to claim."""
+
+        while True:
+            now = time()
+
+            self.fail_expired_shards(now)
+
+            candidates = self.execute(
+                'SELECT id FROM migration_shards '
+                'WHERE status = \'pending\' OR '
+                '(status = \'running\' AND lease_expires_at < :now AND attempts < :max_attempts) '
+                'ORDER BY id LIMIT 10;',
+                {'now': now, 'max_attempts': self.max_attempts}
+            )
+
+            if not candidates:
+                return None
+
+            for candidate in candidates:
+                # the condition is checked again on UPDATE, then just one worker claims the shard
+                claimed = self.execute(
+                    'UPDATE migration_shards '
+                    'SET status = \'running\', worker = :worker, lease_expires_at = :lease_expires_at, '
+                    'heartbeat_at = :now, attempts = attempts + 1 '
+                    'WHERE id = :id AND (status = \'pending\' OR '
+                    '(status = \'running\' AND lease_expires_at < :now AND attempts < :max_attempts));',
+                    {'id': candidate['id'], 'worker': worker, 'now': now, 'lease_expires_at': now + lease_seconds,
+                     'max_attempts': self.max_attempts}
+                )
+
+                if claimed == 1:
+                    return self.execute('SELECT * FROM migration_shards WHERE id = :id;', {'id': candidate['id']})[0]
+
+            # all the candidates have been claimed by other workers, then try again
+
+    def heartbeat(self, shard_id, worker, lease_seconds):
+        """Renew the lease of the shard. Return `False` if the worker has lost the shard."""
+
+        now = time()
+
+        renewed = self.execute(
+            'UPDATE migration_shards SET lease_expires_at = :lease_expires_at, heartbeat_at = :now '
+            'WHERE id = :id AND worker = :worker AND status = \'running\';',
+            {'id': shard_id, 'worker': worker, 'now': now, 'lease_expires_at': now + lease_seconds}
+        )
+
+        return renewed == 1
+
+    def mark_done(self, shard_id, worker, result=None):
+        """Mark the shard as done and save its `result` (a string). Return `False` if the worker has lost the shard."""
+
+        done = self.execute(
+            'UPDATE migration_shards SET status = \'done\', lease_expires_at = NULL, error = NULL, result = :result '
+            'WHERE id = :id AND worker = :worker AND status = \'running\';',
+            {'id': shard_id, 'worker': worker, 'result': result}
+        )
+
+        return done == 1
+
+    def mark_failed(self, shard_id, worker, error):
+        """Release the shard to be tried again or, after `max_attempts`, mark it as failed"""
+
+        self.execute(
+            'UPDATE migration_shards '
+            'SET status = CASE WHEN attempts < :max_attempts THEN \'pending\' ELSE \'failed\' END, '
+            'lease_expires_at = NULL, error = :error '
+            'WHERE id = :id AND worker = :worker AND status = \'running\';',
+            {'id': shard_id, 'worker': worker, 'error': error, 'max_attempts': self.max_attempts}
+        )
+
+    def has_unfinished_shards(self):
+        return bool(self.execute(
+            'SELECT id FROM migration_shards WHERE status IN (\'pending\', \'running\') LIMIT 1;'
+        ))
+
+
+class LeaseLostError(Exception):
+    """The worker has lost the lease of the shard, then it must stop processing it"""
+
+
+class Heartbeat(Thread):
+    """Renew the lease of a shard while the worker processes it.
+
+    The lease is considered lost a safety margin (`lease_seconds / 3`) before it expires, based on the local time
+    of the last renewal, because a renewal can hang (e.g. a locked SQLite or a network failure) while another
+    worker claims the shard."""
+
+    def __init__(self, job_store, shard_id, worker, lease_seconds, renewed_at=None):
+        super().__init__(daemon=True)
+
+        self.job_store = job_store
+        self.shard_id = shard_id
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+
+        # time of the last renewal of the lease (the claim is the first one)
+        self.renewed_at = renewed_at if renewed_at is not None else time()
+
+        self.stopped = Event()
+        # it is set when another worker has claimed the shard
+        self.lease_lost = Event()
+
+    def is_lease_lost(self):
+        """Return `True` if another worker has claimed the shard or the lease is about to expire"""
+
+        deadline = self.renewed_at + self.lease_seconds - self.lease_seconds / 3
+
+        return self.lease_lost.is_set() or time() > deadline
+
+    def run(self):
+        # renew the lease some times before the deadline, to tolerate a slow heartbeat
+        while not self.stopped.wait(self.lease_seconds / 4):
+            # the lease expires `lease_seconds` after the time the renewal has started
+            started_at = time()
+
+            try:
+                if self.job_store.heartbeat(self.shard_id, self.worker, self.lease_seconds):
+                    self.renewed_at = started_at
+                    continue
+
+                # another worker has claimed the shard
+                self.lease_lost.set()
+
+            except SQLAlchemyError as error:
+                logging.warning(f'`{self.worker}` worker could not renew the lease of the shard {self.shard_id}: {error}')
+
+                # it can be tried again, if the deadline has not passed yet
+                if not self.is_lease_lost():
+                    continue
+
+                self.lease_lost.set()
+
+            logging.warning(f'`{self.worker}` worker has lost the lease of the shard {self.shard_id}.')
+            return
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run_worker(job_store, process_shard, worker=None, lease_seconds=60):
+    """Claim shards and call `process_shard(shard, heartbeat)` for each one, until all the shards are finished.
+    `process_shard` must check `heartbeat.is_lease_lost()` before writing and, if it is `True`, stop raising
+    `LeaseLostError`. The value returned by `process_shard` (a string or `None`) is saved as the result of the shard."""
+
+    if worker is None:
+        worker = f'{gethostname()}-{getpid()}'
+
+    logging.info(f'`{worker}` worker has started.')
+
+    while True:
+        shard = job_store.claim_shard(worker, lease_seconds)
+
+        if shard is None:
+            # the shards that are running in other workers can be released if their leases expire
+            if not job_store.has_unfinished_shards():
+                break
+
+            sleep(lease_seconds / 3)
+            continue
+
+        logging.info(f'`{worker}` worker has claimed the shard {shard["id"]} (attempt: {shard["attempts"]}).')
+
+        heartbeat = Heartbeat(job_store, shard['id'], worker, lease_seconds, renewed_at=shard['heartbeat_at'])
+        heartbeat.start()
+
+        try:
+            result = process_shard(shard, heartbeat)
+
+        except LeaseLostError:
+            heartbeat.stop()
+
+            # the shard belongs to another worker now, then it is not marked as failed
+            logging.warning(f'`{worker}` worker has stopped the shard {shard["id"]}, '
+                            'because it has lost the lease and another worker is doing it again.\n')
+            continue
+
+        except Exception as error:
+            heartbeat.stop()
+
+            logging.error(f'`{worker}` worker has failed the shard {shard["id"]}: {error}\n')
+            job_store.mark_failed(shard['id'], worker, str(error))
+            continue
+
+        heartbeat.stop()
+
+        if job_store.mark_done(shard['id'], worker, result=result):
+            logging.info(f'`{worker}` worker has finished the shard {shard["id"]}.\n')
+        else:
+            logging.warning(f'`{worker}` worker has lost the shard {shard["id"]} before marking it as done, '
+                            'then another worker is doing it again.\n')
+
+    logging.info(f'`{worker}` worker has finished, there are not shards left.')
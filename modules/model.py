@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from json import dumps
+from time import perf_counter
 
 from pandas import read_sql, to_datetime
 import pymysql
@@ -54,15 +55,16 @@ class MySQLConnection():
             self.close()
             raise Exception('Connection was not opened to the database.')
 
-    def execute(self, query):
+    def execute(self, query, params=None):
         logging.info('MySQLConnection.execute()')
 
         try:
             logging.info('MySQLConnection.execute() - query: %s\n', query)
+            logging.debug('MySQLConnection.execute() - params: %s\n', params)
 
             self.try_to_connect()
 
-            df = read_sql(query, con=self.engine)
+            df = read_sql(query, con=self.engine, params=params)
 
             return df
 
@@ -85,16 +87,118 @@ class MySQLConnection():
     def select_from_collection(self):
         return self.execute('SELECT * FROM stac_collection;')
 
-    def select_from_item(self):
-        return self.execute('SELECT * FROM stac_item;')
+    def select_count_from_item(self):
+        return int(self.execute('SELECT COUNT(*) AS count FROM stac_item;').at[0, 'count'])
+
+    def select_count_from_item_by_collection(self):
+        return self.execute(
+            'SELECT collection, COUNT(*) AS count FROM stac_item GROUP BY collection ORDER BY collection;'
+        )
+
+    def __filter_items(self, fraction=None, collection=None, after_id=None, last_id=None):
+        """Return the clauses and the params to filter the items, by a random `fraction` of them,
+        by `collection` and/or by a range of ids (`after_id` is not included, `last_id` is)"""
+
+        params = {}
+        conditions = []
+        clauses = ''
+
+        if fraction is not None:
+            params['fraction'] = fraction
+            conditions.append('RAND() < %(fraction)s')
+
+        if collection is not None:
+            params['collection'] = collection
+            conditions.append('i.collection = %(collection)s')
+
+        # the ranges are filtered by id instead of `OFFSET`, so MySQL does not read the rows before the range
+        if after_id is not None:
+            params['after_id'] = after_id
+            conditions.append('i.id > %(after_id)s')
+
+        if last_id is not None:
+            params['last_id'] = last_id
+            conditions.append('i.id <= %(last_id)s')
+
+        if conditions:
+            clauses += ' WHERE ' + ' AND '.join(conditions)
+
+        # the items of a range are always in the same order, then they receive the same ids in the targets
+        if last_id is not None:
+            clauses += ' ORDER BY i.id'
+
+        return clauses, params
+
+    def select_last_id_from_item(self, rows, collection=None, after_id=None):
+        """Return the id of the item that is `rows` items after `after_id` (ordered by id), in the `collection`"""
+
+        clauses, params = self.__filter_items(collection=collection, after_id=after_id)
+        params['offset'] = int(rows) - 1
+
+        df = self.execute(f'SELECT i.id FROM stac_item i{clauses} ORDER BY i.id LIMIT 1 OFFSET %(offset)s;',
+                          params=params)
+
+        # `tolist` returns a Python type, that can be saved in the job table
+        return df['id'].tolist()[0]
+
+    def select_from_item(self, **filters):
+        clauses, params = self.__filter_items(**filters)
+
+        if not params:
+            return self.execute('SELECT * FROM stac_item;')
+
+        return self.execute(f'SELECT * FROM stac_item i{clauses};', params=params)
+
+    def select_from_item_pushdown(self, collection_ids, **filters):
+        """Select just the necessary columns from `stac_item`, with the types fixed, the nulls filled
+        and the `collection_id` resolved by MySQL. `collection_ids` is a dict of collection name to the
+        id the collection receives in the PostgreSQL database."""
+
+        # the items can not be related to any collection, then the derived table would be empty
+        if not collection_ids:
+            raise Exception('There are not collections to select the items with pushdown.')
+
+        clauses, params = self.__filter_items(**filters)
+        collections = []
+
+        # the collection ids are generated by the application, then they are sent as a derived table
+        for index, (name, collection_id) in enumerate(collection_ids.items()):
+            params[f'name_{index}'] = name
+            params[f'collection_id_{index}'] = int(collection_id)
+            collections.append(f'SELECT %(name_{index})s AS name, %(collection_id_{index})s AS collection_id')
+
+        # `+ 0E0` converts the value to DOUBLE, because `CAST(... AS DOUBLE)` does not exist in MySQL 5.7
+        query = (
+            'SELECT i.id AS name, c.collection_id, i.collection, i.datetime, i.date, '
+            'CAST(i.path AS SIGNED) AS path, CAST(i.row AS SIGNED) AS `row`, i.satellite, i.sensor, '
+            'CAST(TRUNCATE(COALESCE(i.cloud_cover, 0), 0) AS SIGNED) AS cloud_cover, '
+            'COALESCE(i.sync_loss, 0) + 0E0 AS sync_loss, '
+            'CAST(i.deleted AS SIGNED) AS deleted, '
+            'COALESCE(i.thumbnail, \'\') AS thumbnail, i.assets, '
+            'i.bl_longitude + 0E0 AS bl_longitude, i.bl_latitude + 0E0 AS bl_latitude, '
+            'i.tr_longitude + 0E0 AS tr_longitude, i.tr_latitude + 0E0 AS tr_latitude '
+            'FROM stac_item i '
+            f'LEFT JOIN ({" UNION ALL ".join(collections)}) c ON c.name = i.collection{clauses};'
+        )
+
+        df = self.execute(query, params=params)
+
+        # an item without collection can not be inserted, then stop here
+        if df['collection_id'].isnull().any():
+            collections_not_found = df[df['collection_id'].isnull()]['collection'].unique().tolist()
+            raise Exception(f'Items with unknown collections have been found: {collections_not_found}')
+
+        df['collection_id'] = df['collection_id'].astype(int)
+
+        return df
 
 
 class PostgreSQLConnection():
 
-    def __init__(self):
+    def __init__(self, url='postgresql+psycopg2://', name=None):
         try:
-            # the elements for connection are got by environment variables
-            self.engine = create_engine('postgresql+psycopg2://')
+            # if the URL is empty, then the elements for connection are got by environment variables
+            self.engine = create_engine(url)
 
         except SQLAlchemyError as error:
             logging.error(f'PostgreSQLConnection.__init__() - An error occurred during engine creation.')
@@ -103,6 +207,9 @@ class PostgreSQLConnection():
 
             raise SQLAlchemyError(error)
 
+        # name used to identify the target in the logs (the password is hidden by `repr`)
+        self.name = name if name else repr(self.engine.url)
+
     def execute(self, query, params=None, is_transaction=False):
         logging.debug('PostgreSQLConnection.execute()')
         logging.debug(f'PostgreSQLConnection.execute() - is_transaction: {is_transaction}')
@@ -129,6 +236,49 @@ class PostgreSQLConnection():
 
             raise SQLAlchemyError(error)
 
+    def execute_dry_run(self, queries, table='bdc.items'):
+        """Execute the queries over a temporary copy of `table` inside a transaction that is rolled back,
+        then nothing is written in the database. Return the time spent by each query and how much
+        the copy of the table has grown, in bytes."""
+
+        logging.debug('PostgreSQLConnection.execute_dry_run()')
+        logging.debug(f'PostgreSQLConnection.execute_dry_run() - table: {table}')
+
+        # the copy has the same columns and indexes, but not the foreign keys, so the items can be
+        # inserted without the collections; it is not WAL-logged, then the time is a bit optimistic
+        create_query = f'CREATE TEMPORARY TABLE dry_run (LIKE {table} INCLUDING ALL);'
+        size_query = 'SELECT pg_total_relation_size(\'dry_run\');'
+
+        seconds = []
+
+        try:
+            with self.engine.connect() as connection:
+                transaction = connection.begin()
+
+                try:
+                    connection.execute(create_query)
+                    size_before = connection.execute(size_query).scalar()
+
+                    for query in queries:
+                        start = perf_counter()
+                        connection.execute(query.replace(f'INSERT INTO {table} ', 'INSERT INTO dry_run '))
+                        seconds.append(perf_counter() - start)
+
+                    size_after = connection.execute(size_query).scalar()
+
+                finally:
+                    # the temporary table is dropped by the rollback as well
+                    transaction.rollback()
+
+        except SQLAlchemyError as error:
+            logging.error(f'PostgreSQLConnection.execute_dry_run() - An error occurred during query execution.')
+            logging.error(f'PostgreSQLConnection.execute_dry_run() - error.code: {error.code} - error.args: {error.args}')
+            logging.error(f'PostgreSQLConnection.execute_dry_run() - error: {error}\n')
+
+            raise SQLAlchemyError(error)
+
+        return seconds, size_after - size_before
+
     ####################################################################################################
     # BAND
     ####################################################################################################
@@ -194,6 +344,34 @@ class PostgreSQLConnection():
             is_transaction=True
         )
 
+    def update_collections_extents(self, extents):
+        """Update the dates and the extent of many collections in just one statement.
+        `extents` is a list of dicts with `id`, `start_date`, `end_date`, `min_x`, `min_y`, `max_x` and `max_y`."""
+
+        if not extents:
+            return
+
+        params = {}
+        values = []
+
+        for index, extent in enumerate(extents):
+            params.update({f'{key}_{index}': value for key, value in extent.items()})
+            values.append(
+                f'(%(id_{index})s, %(start_date_{index})s::date, %(end_date_{index})s::date, '
+                f'%(min_x_{index})s::float8, %(min_y_{index})s::float8, '
+                f'%(max_x_{index})s::float8, %(max_y_{index})s::float8)'
+            )
+
+        query = (
+            'UPDATE bdc.collections AS c '
+            'SET start_date = v.start_date, end_date = v.end_date, '
+            'extent = ST_MakeEnvelope(v.min_x, v.min_y, v.max_x, v.max_y, 4326) '
+            f'FROM (VALUES {", ".join(values)}) AS v (id, start_date, end_date, min_x, min_y, max_x, max_y) '
+            'WHERE c.id = v.id;'
+        )
+
+        self.execute(query, params=params, is_transaction=True)
+
     ####################################################################################################
     # ITEM
     ####################################################################################################
@@ -273,3 +451,10 @@ class PostgreSQLConnection():
     def delete_from_table(self, table):
         self.execute(f'DELETE FROM {table};', is_transaction=True)
 
+    def delete_from_items_by_id_range(self, first_id, last_id):
+        self.execute(
+            'DELETE FROM bdc.items WHERE id BETWEEN %(first_id)s AND %(last_id)s;',
+            params={'first_id': int(first_id), 'last_id': int(last_id)},
+            is_transaction=True
+        )
+
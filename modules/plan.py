@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+"""Measure the migration stages on a sample and extrapolate them to the full catalog"""
+
+from math import ceil
+from resource import getrusage, RUSAGE_SELF
+from time import perf_counter
+
+from numpy import polyfit
+
+
+def get_peak_rss():
+    """Return the peak RSS of the current process, in bytes (Linux returns `ru_maxrss` in kilobytes)"""
+    return getrusage(RUSAGE_SELF).ru_maxrss * 1024
+
+
+class StageMeasure():
+    """Measure the wall time and the growth of the peak RSS while a stage runs.
+    The bytes produced by the stage and its fixed cost (`overhead`, in seconds) are set by the caller."""
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.overhead = 0.0
+        self.rss = 0
+        self.bytes = 0
+
+    def __enter__(self):
+        self.start_rss = get_peak_rss()
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.seconds = perf_counter() - self.start
+        self.rss = get_peak_rss() - self.start_rss
+
+    def per_row(self, rows):
+        return {
+            # the fixed cost does not grow with the number of rows
+            'seconds': max(self.seconds - self.overhead, 0.0) / rows,
+            'bytes': self.bytes / rows,
+            'rss': self.rss / rows
+        }
+
+
+def fit_load_batches(batches):
+    """Fit `seconds = overhead + seconds_per_row * rows` to the measured batches,
+    where `batches` is a list of `(rows, seconds)`. Return `(overhead, seconds_per_row)`."""
+
+    rows = [batch[0] for batch in batches]
+    seconds = [batch[1] for batch in batches]
+
+    # with just one batch size it is not possible to separate the overhead of each batch
+    if len(set(rows)) < 2:
+        return 0.0, sum(seconds) / sum(rows)
+
+    seconds_per_row, overhead = polyfit(rows, seconds, 1)
+
+    # avoid negative values caused by noise in small samples
+    return max(overhead, 0.0), max(seconds_per_row, 0.0)
+
+
+def extrapolate(extract, transform, load, load_batches, sample_rows, total_rows,
+                baseline_rss, workers=(1,), batch_sizes=(10000,), shard_size=100000):
+    """Extrapolate the measures of the sample to the full catalog, for each number of workers and batch size.
+
+    It assumes the sharded mode: each worker is a process that migrates `1 / workers` of the catalog, one shard
+    of up to `shard_size` items at a time, and the databases scale linearly with the number of workers.
+    A worker keeps just one shard in memory and pays the fixed cost of the extract (connection and query)
+    once by shard. For a migration without shards, use a `shard_size` as large as the catalog."""
+
+    overhead, load_seconds_per_row = fit_load_batches(load_batches)
+
+    extract_per_row = extract.per_row(sample_rows)
+    transform_per_row = transform.per_row(sample_rows)
+
+    # the dataframe of a shard is kept in memory until it is loaded, then the RSS growth of the stages adds up;
+    # the load just holds one batch of INSERT clauses at a time, so it does not grow with the number of rows
+    rss_per_row = extract_per_row['rss'] + transform_per_row['rss']
+
+    table_bytes = load.per_row(sample_rows)['bytes'] * total_rows
+
+    estimates = []
+
+    for number_of_workers in workers:
+        rows_per_worker = ceil(total_rows / number_of_workers)
+        shards_per_worker = ceil(rows_per_worker / shard_size)
+        peak_rss_per_worker = baseline_rss + min(rows_per_worker, shard_size) * rss_per_row
+
+        for batch_size in batch_sizes:
+            # the batches are split by shard, then the last batch of each shard can be smaller
+            batches_per_worker = shards_per_worker * ceil(min(rows_per_worker, shard_size) / batch_size)
+
+            wall_time = (
+                shards_per_worker * extract.overhead +
+                rows_per_worker * (extract_per_row['seconds'] + transform_per_row['seconds']) +
+                batches_per_worker * overhead +
+                rows_per_worker * load_seconds_per_row
+            )
+
+            estimates.append({
+                'workers': number_of_workers,
+                'batch_size': batch_size,
+                'wall_time': wall_time,
+                'peak_rss_per_worker': peak_rss_per_worker,
+                'peak_rss': number_of_workers * peak_rss_per_worker,
+                'table_bytes': table_bytes
+            })
+
+    return estimates
@@ -14,3 +14,32 @@ def delete_and_recreate_folder(folder):
 def str2bool(value):
     # Source: https://stackoverflow.com/a/715468
     return str(value).lower() in ('true', 't', '1', 'yes', 'y')
+
+
+def parse_postgres_targets(value):
+    """Parse a comma separated list of `name=url` pairs to a list of `(name, url)` tuples.
+    If a pair does not have a name, then the name is `None`, so the URL is not used as name
+    (it would show the password in the logs)."""
+
+    targets = []
+
+    for target in value.split(','):
+        target = target.strip()
+
+        if not target:
+            continue
+
+        # the name is everything before the first `=`, since it is not part of the URL scheme
+        name, separator, url = target.partition('=')
+        if not separator or '://' in name:
+            name, url = None, target
+
+        name = name.strip() if name is not None else None
+
+        # the failures are kept by target name, then the names must be unique
+        if name is not None and name in [target_name for target_name, _ in targets]:
+            raise Exception(f'Duplicated PostgreSQL target name: `{name}`.')
+
+        targets.append((name, url.strip()))
+
+    return targets